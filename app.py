@@ -1,17 +1,27 @@
 import os
+import re
+import gzip
+import base64
+import math
 import uuid
+import asyncio
+import hashlib
+import operator
+from array import array
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator, Deque, Sequence, Tuple
 
 from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException, Depends
-from fastapi.responses import JSONResponse, FileResponse, HTMLResponse, RedirectResponse
+from fastapi.responses import ORJSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import APIError, AsyncOpenAI, BadRequestError, DefaultAsyncHttpxClient
 import jwt
+import orjson
 
 # -----------------------
 # ENV + CLIENTS
@@ -25,11 +35,37 @@ OPENAI_OUTPUT_MODEL = os.getenv("OPENAI_OUTPUT_MODEL", "gpt-4o")
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", "")
 JWT_SECRET = os.getenv("JWT_SECRET", "change_this_to_a_long_random_secret")
 PORT = int(os.getenv("PORT", "8000"))
+GUEST_MAX_SESSIONS = int(os.getenv("GUEST_MAX_SESSIONS", "1000"))
+# the session cookie (which carries the guest id) is only sent back over HTTPS when
+# this is on; set SESSION_HTTPS_ONLY=0 to run over plain http://, e.g. locally
+SESSION_HTTPS_ONLY = os.getenv("SESSION_HTTPS_ONLY", "1") == "1"
+# how many recent messages (user + assistant) get sent to the model per turn
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "40"))
+# streaming replies are aborted if the model goes this many seconds without a chunk
+STREAM_IDLE_TIMEOUT = float(os.getenv("STREAM_IDLE_TIMEOUT", "30"))
+# bigger request bodies get a 413 (up front from Content-Length, else while streaming in)
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", str(25 * 1024 * 1024)))
+# semantic reply cache (off by default): reuse a recent reply when a new chat's
+# opening question embeds within SEMANTIC_CACHE_SIM cosine of a cached one
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "0") == "1"
+SEMANTIC_CACHE_SIM = float(os.getenv("SEMANTIC_CACHE_SIM", "0.95"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "256"))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "1024"))
+# concurrent embedding misses are coalesced into one API call of up to
+# EMBED_BATCH_MAX inputs, waiting at most EMBED_BATCH_WAIT_MS for the batch to fill
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "64"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "25"))
+# inputs are cut to this many characters so one long message can't push its batch
+# past the embedding model's 8191-token limit
+EMBED_MAX_CHARS = int(os.getenv("EMBED_MAX_CHARS", "8000"))
 
 if not OPENAI_API_KEY:
     print("WARNING: OPENAI_API_KEY is not set. The /chat route will 500.")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# async client: call_openai runs on the event loop, a sync call would block every other request.
+# HTTP/2 lets concurrent completions/embeddings share one pooled TLS connection.
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=DefaultAsyncHttpxClient(http2=True))
 
 # in-memory db (Render starter only - we replace w/ disk/db later)
 USERS: Dict[str, Dict[str, Any]] = {}
@@ -37,6 +73,7 @@ SESSIONS: Dict[str, str] = {}
 CHATS: Dict[str, List[Dict[str, Any]]] = {}
 PROJECTS: Dict[str, List[Dict[str, Any]]] = {}
 USER_BG: Dict[str, str] = {}
+EMAIL_TO_UID: Dict[str, str] = {}  # lowercased email -> user_id, so sign-in isn't a scan of USERS
 
 # structure:
 # USERS[user_id] = {
@@ -69,9 +106,9 @@ def new_user(email: str, name: str, picture: str = "/web/logo.png") -> str:
     """
     Create a new user if not exists and return user_id.
     """
-    for uid, data in USERS.items():
-        if data["email"].lower() == email.lower():
-            return uid
+    uid = EMAIL_TO_UID.get(email.lower())
+    if uid:
+        return uid
 
     user_id = str(uuid.uuid4())
     USERS[user_id] = {
@@ -79,16 +116,65 @@ def new_user(email: str, name: str, picture: str = "/web/logo.png") -> str:
         "email": email,
         "picture": picture,
     }
-    CHATS[user_id] = []
-    PROJECTS[user_id] = [
-        {"id": str(uuid.uuid4()), "name": "Math Study"},
-        {"id": str(uuid.uuid4()), "name": "Bio Unit 3"},
-        {"id": str(uuid.uuid4()), "name": "History DBQ Draft"},
-    ]
-    USER_BG[user_id] = "none"
+    EMAIL_TO_UID[email.lower()] = user_id
+    init_user_state(user_id)
     return user_id
 
 
+def init_user_state(user_id: str) -> None:
+    """
+    Seed chats / starter projects / background for a user, keeping anything
+    that already exists.
+    """
+    CHATS.setdefault(user_id, [])
+    if user_id not in PROJECTS:
+        PROJECTS[user_id] = [
+            {"id": str(uuid.uuid4()), "name": "Math Study"},
+            {"id": str(uuid.uuid4()), "name": "Bio Unit 3"},
+            {"id": str(uuid.uuid4()), "name": "History DBQ Draft"},
+        ]
+    USER_BG.setdefault(user_id, "none")
+
+
+# each anonymous browser session gets its own guest account (id kept in the signed
+# session cookie) so one visitor's chats never end up in another visitor's prompt.
+# Guests are only created by write routes, and the oldest are dropped past
+# GUEST_MAX_SESSIONS to keep the in-memory db bounded.
+GUESTS: "OrderedDict[str, None]" = OrderedDict()
+
+
+def is_guest(uid: Optional[str]) -> bool:
+    return uid in GUESTS
+
+
+def guest_uid(request: Request) -> Optional[str]:
+    gid = request.session.get("guest_id")
+    if gid in GUESTS:
+        GUESTS.move_to_end(gid)
+        return gid
+    return None
+
+
+def new_guest(request: Request) -> str:
+    """
+    Start a fresh guest account for this session (new visitor, or their guest was evicted).
+    """
+    gid = "guest_" + uuid.uuid4().hex
+    request.session["guest_id"] = gid
+    USERS[gid] = {
+        "name": "Guest",
+        "email": "guest@local",
+        "picture": "/web/logo.png",
+    }
+    init_user_state(gid)
+    GUESTS[gid] = None
+    while len(GUESTS) > GUEST_MAX_SESSIONS:
+        old, _ = GUESTS.popitem(last=False)
+        for store in (USERS, CHATS, PROJECTS, USER_BG):
+            store.pop(old, None)
+    return gid
+
+
 def create_session(user_id: str) -> str:
     sess_id = str(uuid.uuid4())
     SESSIONS[sess_id] = user_id
@@ -102,9 +188,33 @@ def get_user_id_from_cookie(request: Request) -> Optional[str]:
     return SESSIONS.get(sess_id)
 
 
+def current_uid(request: Request) -> Optional[str]:
+    """
+    Signed-in user id, or this session's guest id; None for a visitor with neither
+    (read routes then return empty results). Cached on request.state.
+    """
+    uid = getattr(request.state, "uid", None)
+    if uid is None:
+        uid = get_user_id_from_cookie(request) or guest_uid(request)
+        request.state.uid = uid
+    return uid
+
+
+def writer_uid(request: Request) -> str:
+    """
+    current_uid for write routes: starts a guest account if the visitor has none,
+    so probes / crawlers hitting read routes never create (or evict) guests.
+    """
+    uid = current_uid(request)
+    if uid is None:
+        uid = new_guest(request)
+        request.state.uid = uid
+    return uid
+
+
 def require_user(request: Request) -> str:
-    uid = get_user_id_from_cookie(request)
-    if not uid:
+    uid = current_uid(request)
+    if uid is None or is_guest(uid):
         raise HTTPException(status_code=401, detail="Not signed in")
     return uid
 
@@ -113,7 +223,8 @@ def require_user(request: Request) -> str:
 # FASTAPI APP
 # -----------------------
 
-app = FastAPI()
+# orjson encodes the small JSON bodies (/me, /chats, /chat) much faster than stdlib json
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Allow browser JS from same origin to talk to API
 app.add_middleware(
@@ -129,9 +240,69 @@ app.add_middleware(
     SessionMiddleware,
     secret_key=JWT_SECRET,
     same_site="lax",
-    https_only=True,
+    https_only=SESSION_HTTPS_ONLY,
 )
 
+class LimitBodySize:
+    """
+    Pure ASGI middleware capping request bodies at max_bytes: a Content-Length over
+    the limit gets a 413 before anything is read, and bodies without one (chunked
+    uploads) are counted as they arrive and cut off with a 413 once past the limit,
+    before the route has buffered or parsed them.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                if value.isdigit() and int(value) > self.max_bytes:
+                    await self._too_large(scope, receive, send)
+                    return
+                break
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # FastAPI passes HTTPException through body parsing as-is
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except HTTPException as e:
+            # only reached when nothing inside turned it into a response (e.g. StaticFiles)
+            if e.status_code != 413 or started:
+                raise
+            await self._too_large(scope, receive, send)
+
+    @staticmethod
+    async def _too_large(scope, receive, send):
+        resp = ORJSONResponse({"detail": "Request body too large"}, status_code=413)
+        await resp(scope, receive, send)
+
+
+app.add_middleware(LimitBodySize, max_bytes=MAX_BODY_BYTES)
+
+
 # serve /web/* as static
 app.mount("/web", StaticFiles(directory="web"), name="web")
 
@@ -174,47 +345,103 @@ def summarize_title(history: List[Dict[str, Any]]) -> str:
     return "New chat"
 
 
-async def call_openai(user_text: str, image_data_b64: Optional[str]) -> str:
+_B64_BODY_RE = re.compile(r"[A-Za-z0-9+/]*")
+_B64_TAIL_RE = re.compile(r"[A-Za-z0-9+/]*={0,2}")
+# chars per regex pass (a multiple of 4; ~4ms each). The regex holds the GIL, so a
+# worker thread wouldn't free the loop - yielding between slices does.
+B64_SLICE = 1024 * 1024
+
+
+async def valid_b64(data: str) -> bool:
     """
-    Calls OpenAI. If image_data_b64 is provided, ask GPT-4o vision-style.
-    Otherwise do normal text.
+    Length + alphabet check for standard base64, in slices with a yield to the event
+    loop between them. Padding is only allowed in the last slice. No decode buffer.
     """
-    if not OPENAI_API_KEY:
-        return "[OpenAI key not configured]"
+    n = len(data)
+    if n % 4:
+        return False
+    for start in range(0, n, B64_SLICE):
+        end = start + B64_SLICE
+        pattern = _B64_TAIL_RE if end >= n else _B64_BODY_RE
+        if pattern.fullmatch(data, start, end) is None:
+            return False
+        await asyncio.sleep(0)
+    return True
+
+
+# base64 of each format's magic bytes -> media type; anything else is rejected up front
+IMAGE_B64_PREFIXES = {
+    "/9j/": "image/jpeg",
+    "iVBOR": "image/png",
+    "R0lGOD": "image/gif",
+    "UklGR": "image/webp",  # only "RIFF": confirmed as WEBP in _sniff_image_type
+}
+
+
+def _sniff_image_type(data: str) -> Optional[str]:
+    for prefix, media_type in IMAGE_B64_PREFIXES.items():
+        if data.startswith(prefix):
+            if media_type == "image/webp":
+                # RIFF also wraps WAV/AVI; the first 12 bytes must read RIFF....WEBP
+                try:
+                    head = base64.b64decode(data[:16], validate=True)
+                except ValueError:
+                    return None
+                if head[8:12] != b"WEBP":
+                    return None
+            return media_type
+    return None
+
+
+SYSTEM_PROMPT = (
+    "You are PranayAI, a study assistant for students in Poway Unified. "
+    "You help explain, you don't just give final answers to turn in. "
+    "Always encourage using results responsibly."
+)
 
-    # message list for model
-    msgs = []
 
-    # system prompt w/ safe school policy
-    msgs.append({
-        "role": "system",
-        "content": (
-            "You are PranayAI, a study assistant for students in Poway Unified. "
-            "You help explain, you don't just give final answers to turn in. "
-            "Always encourage using results responsibly."
-        )
-    })
+def _to_text_msg(m: Dict[str, Any]) -> Dict[str, str]:
+    return {"role": m["role"], "content": m["text"]}
 
-    # user block
-    if image_data_b64:
-        # vision style prompt
-        # NOTE: true vision multimodal with OpenAI REST is different format
-        # here we just tell the model there's an image, but not actually sending bytes yet,
-        # because that's a separate upload route we'd wire later.
-        msgs.append({
-            "role": "user",
-            "content": f"[Image attached - base64 not fully wired yet]\n{user_text}"
-        })
-    else:
-        msgs.append({
-            "role": "user",
-            "content": user_text
-        })
+
+def _to_image_msg(m: Dict[str, Any]) -> Dict[str, str]:
+    # vision style prompt
+    # NOTE: true vision multimodal with OpenAI REST is different format
+    # here we just tell the model there's an image, but not actually sending bytes yet,
+    # because that's a separate upload route we'd wire later.
+    return {"role": m["role"], "content": f"[Image attached - base64 not fully wired yet]\n{m['text']}"}
+
+
+# stored msg_type -> OpenAI message builder (unknown types fall back to text)
+MSG_BUILDERS = {
+    "text": _to_text_msg,
+    "image": _to_image_msg,
+}
+
+
+def build_openai_messages(history: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    # system prompt w/ safe school policy, then a rolling window of the conversation
+    # so per-turn payload / latency stays bounded no matter how long the chat gets
+    msgs = [{"role": "system", "content": SYSTEM_PROMPT}]
+    msgs.extend(
+        MSG_BUILDERS.get(m.get("msg_type"), _to_text_msg)(m)
+        for m in history[-HISTORY_MAX_MESSAGES:]
+    )
+    return msgs
+
+
+async def call_openai(history: List[Dict[str, Any]]) -> str:
+    """
+    Calls OpenAI with the chat's in-memory history (already includes the new
+    user turn).
+    """
+    if not OPENAI_API_KEY:
+        return "[OpenAI key not configured]"
 
     # Use output model for final reasoning (gpt-4o)
-    completion = client.chat.completions.create(
+    completion = await client.chat.completions.create(
         model=OPENAI_OUTPUT_MODEL,
-        messages=msgs,
+        messages=build_openai_messages(history),
         temperature=0.4,
     )
 
@@ -222,15 +449,174 @@ async def call_openai(user_text: str, image_data_b64: Optional[str]) -> str:
     return completion.choices[0].message.content if completion.choices else "[no response]"
 
 
+async def stream_openai(history: List[Dict[str, Any]]) -> AsyncIterator[str]:
+    """
+    Same as call_openai but yields text deltas as they arrive.
+    Raises asyncio.TimeoutError if no chunk shows up for STREAM_IDLE_TIMEOUT seconds.
+    """
+    if not OPENAI_API_KEY:
+        yield "[OpenAI key not configured]"
+        return
+
+    stream = await client.chat.completions.create(
+        model=OPENAI_OUTPUT_MODEL,
+        messages=build_openai_messages(history),
+        temperature=0.4,
+        stream=True,
+    )
+    chunks = stream.__aiter__()
+    try:
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), STREAM_IDLE_TIMEOUT)
+            except StopAsyncIteration:
+                break
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        await stream.close()
+
+
+# (unit-length question embedding, reply), oldest evicted first
+SEMANTIC_REPLIES: Deque[Tuple[Sequence[float], str]] = deque(maxlen=SEMANTIC_CACHE_SIZE)
+
+class QueryEmbedBatcher:
+    """
+    Collects embedding requests from concurrent callers and sends them to
+    OpenAI as one input=[...] call; each caller gets back its own vector.
+    """
+
+    def __init__(self, max_batch: int, max_wait_ms: float):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def submit(self, text: str) -> List[float]:
+        # the API rejects empty inputs, and it fails the whole batch when it does
+        text = text.strip()[:EMBED_MAX_CHARS]
+        if not text:
+            raise ValueError("cannot embed empty text")
+        # background drain task is started lazily, on the running loop
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._drain())
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, fut))
+        return await fut
+
+    async def _drain(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._send(batch)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        try:
+            res = await client.embeddings.create(model=EMBEDDING_MODEL, input=[t for t, _ in batch])
+        except BadRequestError as e:
+            if len(batch) > 1:
+                # one bad input fails the whole call: retry item by item so it only
+                # fails its own caller
+                await asyncio.gather(*(self._send([item]) for item in batch))
+                return
+            self._fail(batch, e)
+            return
+        except Exception as e:
+            # rate limits / 5xx / connection errors: retrying per item would only
+            # multiply the load, so the whole batch fails
+            self._fail(batch, e)
+            return
+        got = {d.index: d.embedding for d in res.data}
+        for i, (_, fut) in enumerate(batch):
+            if fut.done():
+                continue
+            if i in got:
+                fut.set_result(got[i])
+            else:
+                fut.set_exception(RuntimeError("embeddings response is missing this input"))
+
+    @staticmethod
+    def _fail(batch: List[Tuple[str, asyncio.Future]], exc: BaseException) -> None:
+        for _, fut in batch:
+            if not fut.done():
+                fut.set_exception(exc)
+
+
+EMBED_BATCHER = QueryEmbedBatcher(EMBED_BATCH_MAX, EMBED_BATCH_WAIT_MS)
+
+# sha256(model + NUL + text) -> unit-length float32 embedding, least recently used evicted first
+EMBED_CACHE: "OrderedDict[bytes, array]" = OrderedDict()
+
+
+async def embed_query(text: str) -> Sequence[float]:
+    key = hashlib.sha256(f"{EMBEDDING_MODEL}\0{text}".encode("utf-8")).digest()
+    vec = EMBED_CACHE.get(key)
+    if vec is not None:
+        EMBED_CACHE.move_to_end(key)
+        return vec
+
+    raw = await EMBED_BATCHER.submit(text)
+    norm = math.sqrt(sum(x * x for x in raw)) or 1.0
+    vec = array("f", (x / norm for x in raw))  # ~6KB per entry vs ~50KB as a list of floats
+
+    EMBED_CACHE[key] = vec
+    if len(EMBED_CACHE) > EMBED_CACHE_SIZE:
+        EMBED_CACHE.popitem(last=False)
+    return vec
+
+
+def semantic_lookup(q_vec: Sequence[float], entries: List[Tuple[Sequence[float], str]]) -> Optional[str]:
+    """
+    Best reply in entries at or above SEMANTIC_CACHE_SIM (vectors are unit length, so dot == cosine).
+    Pure-Python scan (~20ms at 256 x 1536), so callers run it via asyncio.to_thread.
+    """
+    best, best_sim = None, SEMANTIC_CACHE_SIM
+    for vec, reply in entries:
+        sim = sum(map(operator.mul, q_vec, vec))
+        if sim >= best_sim:
+            best, best_sim = reply, sim
+    return best
+
+
 # -----------------------
 # ROUTES
 # -----------------------
 
-@app.get("/", response_class=HTMLResponse)
-async def serve_index():
-    # return the built React-style HTML we wrote
-    with open("web/index.html", "r", encoding="utf-8") as f:
-        return f.read()
+# index.html is read + gzipped once at import; clients revalidate with the ETag
+with open("web/index.html", "rb") as f:
+    INDEX_HTML = f.read()
+INDEX_GZ = gzip.compress(INDEX_HTML, compresslevel=9)
+# plain and gzip bodies are different byte representations, so each gets its own strong ETag
+INDEX_ETAG = '"' + hashlib.md5(INDEX_HTML).hexdigest() + '"'
+INDEX_GZ_ETAG = '"' + hashlib.md5(INDEX_GZ).hexdigest() + '-gz"'
+INDEX_HEADERS = {
+    "Cache-Control": "public, max-age=3600",
+    "ETag": INDEX_ETAG,
+    "Vary": "Accept-Encoding",
+}
+INDEX_GZ_HEADERS = {**INDEX_HEADERS, "ETag": INDEX_GZ_ETAG, "Content-Encoding": "gzip"}
+
+
+@app.get("/")
+async def serve_index(request: Request):
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        body, etag, headers = INDEX_GZ, INDEX_GZ_ETAG, INDEX_GZ_HEADERS
+    else:
+        body, etag, headers = INDEX_HTML, INDEX_ETAG, INDEX_HEADERS
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={k: v for k, v in headers.items() if k != "Content-Encoding"})
+    return Response(body, media_type="text/html; charset=utf-8", headers=headers)
 
 
 @app.get("/me")
@@ -260,36 +646,27 @@ async def me(request: Request):
 
 
 class ChatRequest(BaseModel):
-    message: str
-    image_b64: Optional[str] = None
-    chat_id: Optional[str] = None
+    message: str = Field(..., max_length=32_000)
+    image_b64: Optional[str] = Field(default=None, max_length=20 * 1024 * 1024)  # ~15MB decoded
+    chat_id: Optional[str] = Field(default=None, max_length=128)
+    stream: bool = False
 
 
 @app.post("/chat")
 async def chat_endpoint(req: ChatRequest, request: Request):
-    uid = get_user_id_from_cookie(request)
-
-    # if not signed in, let them still chat but it's "guest" in memory
-    guest_mode = False
-    if not uid:
-        guest_mode = True
-        uid = "GUEST"
-        if uid not in USERS:
-            USERS[uid] = {
-                "name": "Guest",
-                "email": "guest@local",
-                "picture": "/web/logo.png",
-            }
-        if uid not in CHATS:
-            CHATS[uid] = []
-        if uid not in USER_BG:
-            USER_BG[uid] = "none"
-        if uid not in PROJECTS:
-            PROJECTS[uid] = [
-                {"id": str(uuid.uuid4()), "name": "Math Study"},
-                {"id": str(uuid.uuid4()), "name": "Bio Unit 3"},
-                {"id": str(uuid.uuid4()), "name": "History DBQ Draft"},
-            ]
+    if req.image_b64:
+        if _sniff_image_type(req.image_b64) is None:
+            raise HTTPException(status_code=400, detail="image_b64 must be a JPEG, PNG, GIF or WebP image")
+        # a multi-MB string is scanned in slices so other requests run in between
+        if not await valid_b64(req.image_b64):
+            raise HTTPException(status_code=400, detail="image_b64 is not valid base64")
+
+    # if not signed in, let them still chat but it's "guest" in memory.
+    # Resolved after the await above, and nothing below awaits before the chat is
+    # stored, so a guest evicted meanwhile gets a new account instead of a store
+    # outside GUESTS that would never be evicted again.
+    uid = writer_uid(request)
+    guest_mode = is_guest(uid)
 
     # pick chat
     if req.chat_id:
@@ -315,14 +692,49 @@ async def chat_endpoint(req: ChatRequest, request: Request):
     user_msg = {
         "role": "user",
         "text": req.message,
+        "msg_type": "image" if req.image_b64 else "text",
         "ts": friendly_timestamp(),
     }
     chat_obj["messages"].append(user_msg)
 
-    # call model
-    ai_text = await call_openai(req.message, req.image_b64)
+    # semantic cache only covers a chat's opening text question; later replies depend on history
+    q_vec, cached = None, None
+    if SEMANTIC_CACHE and OPENAI_API_KEY and not req.image_b64 and len(chat_obj["messages"]) == 1:
+        try:
+            q_vec = await embed_query(req.message)
+            # scan a snapshot in a worker thread: keeps the loop free and the deque
+            # safe from appends by other requests while we iterate
+            cached = await asyncio.to_thread(semantic_lookup, q_vec, list(SEMANTIC_REPLIES))
+        except Exception:
+            q_vec = None  # cache is best-effort, fall through to the model
+
+    if req.stream:
+        return StreamingResponse(
+            stream_reply(chat_obj, guest_mode, q_vec, cached),
+            media_type="text/event-stream",
+        )
+
+    # call model (history lives on chat_obj already, no re-fetch needed)
+    if cached is not None:
+        ai_text = cached
+    else:
+        ai_text = await call_openai(chat_obj["messages"])
+        if q_vec is not None:
+            SEMANTIC_REPLIES.append((q_vec, ai_text))
+    asst_msg = record_reply(chat_obj, ai_text)
+
+    return {
+        "chat_id": chat_obj["id"],
+        "assistant": ai_text,
+        "ts": asst_msg["ts"],
+        "guest_mode": guest_mode,
+    }
+
 
-    # store assistant message
+def record_reply(chat_obj: Dict[str, Any], ai_text: str) -> Dict[str, Any]:
+    """
+    Store the assistant message and retitle the chat if it's still default.
+    """
     asst_msg = {
         "role": "assistant",
         "text": ai_text,
@@ -333,20 +745,60 @@ async def chat_endpoint(req: ChatRequest, request: Request):
     # update chat title if still default
     if chat_obj["title"] == "New chat":
         chat_obj["title"] = summarize_title(chat_obj["messages"])
+    return asst_msg
 
-    return {
+
+def sse_event(data: Dict[str, Any]) -> bytes:
+    return b"data: " + orjson.dumps(data) + b"\n\n"
+
+
+async def stream_reply(
+    chat_obj: Dict[str, Any],
+    guest_mode: bool,
+    q_vec: Optional[Sequence[float]] = None,
+    cached: Optional[str] = None,
+) -> AsyncIterator[bytes]:
+    """
+    SSE body for /chat with stream=true: {"chunk": ...} events, then one final
+    {"done": true, ...} event carrying the same fields as the JSON reply.
+    A semantic cache hit is sent as a single chunk.
+    """
+    parts: List[str] = []
+    if cached is not None:
+        parts.append(cached)
+        yield sse_event({"chunk": cached})
+    else:
+        try:
+            async for piece in stream_openai(chat_obj["messages"]):
+                parts.append(piece)
+                yield sse_event({"chunk": piece})
+        except asyncio.TimeoutError:
+            q_vec = None  # don't cache a truncated reply
+            parts.append("\n[response timed out]")
+            yield sse_event({"chunk": parts[-1]})
+        except APIError:
+            # the 200 headers are already out, so report it in-band and still finish
+            # with the done event (and a recorded assistant turn) below
+            q_vec = None
+            parts.append("\n[model request failed, please try again]")
+            yield sse_event({"chunk": parts[-1]})
+
+    ai_text = "".join(parts)
+    if q_vec is not None and cached is None:
+        SEMANTIC_REPLIES.append((q_vec, ai_text))
+    asst_msg = record_reply(chat_obj, ai_text)
+    yield sse_event({
+        "done": True,
         "chat_id": chat_obj["id"],
         "assistant": ai_text,
         "ts": asst_msg["ts"],
         "guest_mode": guest_mode,
-    }
+    })
 
 
 @app.get("/chats")
 async def list_chats(request: Request):
-    uid = get_user_id_from_cookie(request)
-    if not uid:
-        uid = "GUEST"
+    uid = current_uid(request)
     arr = []
     for c in CHATS.get(uid, []):
         arr.append({
@@ -359,9 +811,7 @@ async def list_chats(request: Request):
 
 @app.get("/chat/{chat_id}")
 async def get_chat(chat_id: str, request: Request):
-    uid = get_user_id_from_cookie(request)
-    if not uid:
-        uid = "GUEST"
+    uid = current_uid(request)
 
     for c in CHATS.get(uid, []):
         if c["id"] == chat_id:
@@ -381,14 +831,12 @@ async def delete_chat(chat_id: str, request: Request):
 
 
 class NewProjectReq(BaseModel):
-    name: str
+    name: str = Field(..., max_length=200)
 
 
 @app.post("/projects")
 async def create_project(req: NewProjectReq, request: Request):
-    uid = get_user_id_from_cookie(request)
-    if not uid:
-        uid = "GUEST"
+    uid = writer_uid(request)
     if uid not in PROJECTS:
         PROJECTS[uid] = []
     proj_id = str(uuid.uuid4())
@@ -398,30 +846,24 @@ async def create_project(req: NewProjectReq, request: Request):
 
 @app.get("/projects")
 async def list_projects(request: Request):
-    uid = get_user_id_from_cookie(request)
-    if not uid:
-        uid = "GUEST"
+    uid = current_uid(request)
     return PROJECTS.get(uid, [])
 
 
 class BGReq(BaseModel):
-  background_url: str
+  background_url: str = Field(..., max_length=2048)
 
 
 @app.post("/set-background")
 async def set_background(req: BGReq, request: Request):
-    uid = get_user_id_from_cookie(request)
-    if not uid:
-        uid = "GUEST"
+    uid = writer_uid(request)
     USER_BG[uid] = req.background_url
     return {"ok": True}
 
 
 @app.get("/background")
 async def get_background(request: Request):
-    uid = get_user_id_from_cookie(request)
-    if not uid:
-        uid = "GUEST"
+    uid = current_uid(request)
     return {"background_url": USER_BG.get(uid, "none")}
 
 
@@ -453,15 +895,50 @@ async def do_logout(request: Request):
 
 
 # basic help/policy for the modal
+# the body never changes while the process runs, so encode it once and let
+# browsers / proxies revalidate with the ETag instead of refetching
+HELP_BODY = {
+    "title": "Responsible Use Policy",
+    "body": [
+        "PranayAI is here to explain, tutor, and help you study.",
+        "Do not turn in AI-generated text as your own graded work unless your teacher gave permission.",
+        "No harassment, hate, self-harm, or illegal content.",
+        "This service is categorized as Educational/Study Support — not gaming, not adult, not unknown.",
+    ],
+    "district_note": "Built for students to learn how and why, not just copy answers.",
+}
+HELP_JSON = orjson.dumps(HELP_BODY)
+HELP_ETAG = '"' + hashlib.sha1(HELP_JSON).hexdigest() + '"'
+HELP_HEADERS = {"Cache-Control": "public, max-age=60", "ETag": HELP_ETAG}
+
+
 @app.get("/help")
-async def help_page():
-    return {
-        "title": "Responsible Use Policy",
-        "body": [
-            "PranayAI is here to explain, tutor, and help you study.",
-            "Do not turn in AI-generated text as your own graded work unless your teacher gave permission.",
-            "No harassment, hate, self-harm, or illegal content.",
-            "This service is categorized as Educational/Study Support — not gaming, not adult, not unknown.",
-        ],
-        "district_note": "Built for students to learn how and why, not just copy answers.",
-    }
+async def help_page(request: Request):
+    if request.headers.get("if-none-match") == HELP_ETAG:
+        return Response(status_code=304, headers=HELP_HEADERS)
+    return Response(content=HELP_JSON, media_type="application/json", headers=HELP_HEADERS)
+
+
+# root-level assets like /logo.png (index itself is served by serve_index above).
+# StaticFiles handles ETag/304 and sendfile; must be mounted after every API route.
+app.mount("/", StaticFiles(directory="web", html=True), name="root")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # loop/http "auto" pick uvloop + httptools when installed (see requirements.txt).
+    # Sessions and chats live in this process's memory, so keep WORKERS=1 unless
+    # that moves to shared storage.
+    workers = int(os.getenv("WORKERS", "1"))
+    uvicorn.run(
+        # one worker serves this already-imported app; an import string would run all
+        # of the module setup above a second time. Multiple workers need the string.
+        app if workers == 1 else "app:app",
+        host="0.0.0.0",
+        port=PORT,
+        loop="auto",
+        http="auto",
+        workers=workers,
+        access_log=os.getenv("ACCESS_LOG", "0") == "1",
+    )
@@ -1,15 +1,20 @@
 # Claude-only LLM helpers (text + image)
-import os, base64
+import os
+import pybase64
 from typing import List, Dict, Any
 from dotenv import load_dotenv
-from anthropic import Anthropic
+from anthropic import Anthropic, DefaultHttpxClient
 
 load_dotenv()
 
 MODEL = os.getenv("ANTHROPIC_MODEL", "claude-3-5-sonnet-20240620")
 API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
 
-_client = Anthropic(api_key=API_KEY)
+_client = Anthropic(api_key=API_KEY, http_client=DefaultHttpxClient(http2=True))
+
+def extract_text_blocks(resp) -> str:
+    """Concatenate the text blocks of an Anthropic reply in one join."""
+    return "".join(b.text for b in resp.content if getattr(b, "type", "") == "text").strip()
 
 def chat_llm(messages: List[Dict[str, str]]) -> str:
     """OpenAI-style messages -> Anthropic reply text."""
@@ -33,13 +38,13 @@ def chat_llm(messages: List[Dict[str, str]]) -> str:
         system=system.strip() or None,
         messages=turns if turns else [{"role": "user", "content": [{"type":"text","text":"Hello"}]}],
     )
-    return "".join([b.text for b in resp.content if getattr(b, "type", "") == "text"]).strip()
+    return extract_text_blocks(resp)
 
 def chat_llm_image(system_prompt: str, user_prompt: str, image_bytes: bytes, mime: str = "image/png") -> str:
     """Single-turn image + text -> reply text."""
     content = [
         {"type": "text", "text": user_prompt},
-        {"type": "image", "source": {"type": "base64", "media_type": mime, "data": base64.b64encode(image_bytes).decode("utf-8")}},
+        {"type": "image", "source": {"type": "base64", "media_type": mime, "data": pybase64.b64encode(image_bytes).decode("ascii")}},
     ]
     resp = _client.messages.create(
         model=MODEL,
@@ -47,4 +52,4 @@ def chat_llm_image(system_prompt: str, user_prompt: str, image_bytes: bytes, mim
         system=system_prompt or None,
         messages=[{"role": "user", "content": content}],
     )
-    return "".join([b.text for b in resp.content if getattr(b, "type", "") == "text"]).strip()
+    return extract_text_blocks(resp)
@@ -2,10 +2,11 @@
 import sys, os, glob
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))  # allow 'from retriever import Retriever'
 
-from retriever import Retriever
-
 def main():
     import argparse
+    # imported here, not at module top: file-reader workers are spawned and re-run
+    # this module's top level, and must not pull in torch / the embedding model
+    from retriever import Retriever
     p = argparse.ArgumentParser()
     p.add_argument("folder", help="folder containing .pdf/.txt/.md")
     args = p.parse_args()
@@ -24,7 +25,8 @@ def main():
     if not paths:
         print(f"No ingestible files found in {folder}"); return
 
-    r = Retriever(persist_dir=os.getenv("CHROMA_DIR", "chroma_db"))
+    r = Retriever(persist_dir=os.getenv("CHROMA_DIR", "chroma_db"),
+                  embeddings_backend=os.getenv("EMBEDDINGS_BACKEND", "local"))
     before = r.collection.count()
     r.ingest(paths)
     after = r.collection.count()
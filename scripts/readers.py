@@ -0,0 +1,64 @@
+# scripts/readers.py
+# File -> text readers for ingest. Kept free of torch / sentence_transformers / chromadb
+# so the process-pool workers that run them start fast and stay small.
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Iterator
+
+from pypdf import PdfReader
+
+# files in flight per worker: enough to keep the pool busy, while the slower
+# embed step downstream only ever has a handful of extracted files in memory
+READ_AHEAD_PER_WORKER = 2
+
+def read_pdf(path: str) -> str:
+    try:
+        reader = PdfReader(path)
+        return "\n".join([(p.extract_text() or "") for p in reader.pages])
+    except Exception:
+        # if encrypted/unsupported, skip gracefully
+        return ""
+
+def read_text_file(path: str) -> str:
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        return f.read()
+
+# file extension -> reader
+READERS = {
+    ".pdf": read_pdf,
+    ".txt": read_text_file,
+    ".md": read_text_file,
+    ".markdown": read_text_file,
+}
+
+def file_ext(path: str) -> str:
+    return os.path.splitext(path)[1].lower()
+
+def read_path(path: str) -> str:
+    reader = READERS.get(file_ext(path))
+    return reader(path) if reader else ""
+
+def read_all(paths: List[str]) -> Iterator[str]:
+    """Yield each file's text in input order.
+
+    pypdf text extraction is pure-Python CPU work, so whole files are spread across
+    processes, with at most READ_AHEAD_PER_WORKER files per worker submitted ahead of
+    the consumer. Workers are spawned (not forked) so they never inherit a loaded model.
+    """
+    workers = min(len(paths), os.cpu_count() or 1)
+    if workers <= 1:
+        yield from map(read_path, paths)
+        return
+
+    todo = iter(paths)
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        window = deque(pool.submit(read_path, p) for _, p in zip(range(workers * READ_AHEAD_PER_WORKER), todo))
+        while window:
+            fut = window.popleft()
+            nxt = next(todo, None)
+            if nxt is not None:
+                window.append(pool.submit(read_path, nxt))
+            yield fut.result()
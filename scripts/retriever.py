@@ -1,62 +1,209 @@
-import os, re
+import os, json, time, hashlib
 from dataclasses import dataclass
-from typing import List, Dict, Any, Iterable
+from functools import lru_cache
+from typing import List, Dict, Any, Iterable, Optional
 
 import chromadb
-from pypdf import PdfReader
+import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
 
+from readers import READERS, file_ext, read_all
+
+# near-duplicate questions (cosine >= this) reuse the previous search results
+SEMANTIC_CACHE_SIM = float(os.getenv("SEMANTIC_CACHE_SIM", "0.95"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1024"))
+# cached results expire after this many seconds; the whole cache is also dropped whenever
+# collection.count() changes (e.g. scripts/ingest.py ran in another process). count() is
+# a round trip in CHROMA_HOST mode, so it's checked at most every SEMANTIC_CACHE_CHECK_SECS
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "300"))
+SEMANTIC_CACHE_CHECK_SECS = float(os.getenv("SEMANTIC_CACHE_CHECK_SECS", "10"))
+
+# embeddings_backend="onnx": int8 MiniLM exported once with
+#   optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 minilm-onnx/
+#   optimum-cli onnxruntime quantize --onnx_model minilm-onnx/ --avx512_vnni -o minilm-onnx-int8/
+# (copy the tokenizer files from minilm-onnx/ alongside). Same 384-dim vectors as "local".
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "minilm-onnx-int8")
+
+# set CHROMA_HOST to use a chroma server (`chroma run --path ./chroma_db --port 8001`)
+# instead of the in-process store, so HNSW inserts/persistence happen in that process
+CHROMA_HOST = os.getenv("CHROMA_HOST", "")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8001"))
+
+# VECTOR_INDEX=flat skips chroma/HNSW and does exact top-k over a float32 matrix
+# (see _FlatStore); fine for small stores (up to ~100k chunks). Every add rewrites the
+# whole vector file and the whole metadata JSON, so ingest cost grows with store size
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "hnsw")
+
+# chunks per embed + collection.add during ingest (capped to chroma's max batch size);
+# fewer, larger adds mean fewer HNSW insert passes and store commits
+INGEST_BATCH = int(os.getenv("INGEST_BATCH", "5000"))
+ONNX_BATCH_SIZE = 64
+
 @dataclass
 class DocChunk:
     text: str
     metadata: Dict[str, Any]
 
-def _read_pdf(path: str) -> str:
-    try:
-        reader = PdfReader(path)
-        return "\n".join([(p.extract_text() or "") for p in reader.pages])
-    except Exception:
-        # if encrypted/unsupported, skip gracefully
-        return ""
-
-def _read_text_file(path: str) -> str:
-    with open(path, "r", encoding="utf-8", errors="ignore") as f:
-        return f.read()
+def _copy_chunks(chunks: List[DocChunk]) -> List[DocChunk]:
+    # cached results are handed out as copies so callers can't mutate the cache
+    return [DocChunk(text=c.text, metadata=dict(c.metadata)) for c in chunks]
 
 def _chunk_text(text: str, max_chars: int = 1200, overlap: int = 150) -> List[str]:
-    words, chunks, current, length = text.split(), [], [], 0
-    for w in words:
-        if length + len(w) + 1 > max_chars:
-            chunks.append(" ".join(current))
-            back = " ".join(current)[-overlap:].split()
-            current, length = back[:], sum(len(x)+1 for x in back)
-        current.append(w); length += len(w)+1
-    if current: chunks.append(" ".join(current))
-    return [re.sub(r"\s+", " ", c).strip() for c in chunks if c.strip()]
+    # collapse whitespace once, then cut windows straight out of the string by offset
+    # (no per-word list, no re-joining / re-splitting for the overlap)
+    text = " ".join(text.split())
+    chunks, i, n = [], 0, len(text)
+    while i < n:
+        end = min(i + max_chars, n)
+        if end < n:
+            sp = text.rfind(" ", i, end + 1)  # snap back to a word boundary
+            if sp > i:
+                end = sp
+        chunks.append(text[i:end])
+        if end >= n:
+            break
+        # next window starts at the first whole word inside the last `overlap` chars
+        sp = text.find(" ", max(end - overlap, i + 1), end)
+        if sp != -1:
+            i = sp + 1
+        else:
+            i = end + 1 if text[end] == " " else end
+    return chunks
+
+class _FlatStore:
+    """Exact-search stand-in for the chroma collection: vectors in a float32 .npy
+    (memory-mapped), ids/documents/metadata in JSON, top-k via one matmul."""
+
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.vec_path = os.path.join(path, "vectors.f32.npy")
+        self.meta_path = os.path.join(path, "flat_meta.json")
+        self.vectors = np.load(self.vec_path, mmap_mode="r") if os.path.exists(self.vec_path) else None
+        self.rows: List[list] = []  # [id, document, metadata]
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.rows = json.load(f)
+        n_vec = 0 if self.vectors is None else self.vectors.shape[0]
+        if len(self.rows) != n_vec:
+            raise RuntimeError(f"{self.meta_path} has {len(self.rows)} rows but "
+                               f"{self.vec_path} has {n_vec} vectors; re-run ingest into a fresh directory")
+        self._ids = {r[0] for r in self.rows}
+
+    def count(self) -> int:
+        return len(self.rows)
+
+    def add(self, ids, embeddings, documents, metadatas):
+        # like chroma, ids that already exist are ignored
+        keep = []
+        for i, id_ in enumerate(ids):
+            if id_ not in self._ids:
+                self._ids.add(id_)
+                keep.append(i)
+        if not keep:
+            return
+        new = np.asarray([embeddings[i] for i in keep], dtype=np.float32)
+        # concatenate drops the old memmap before the file is rewritten
+        self.vectors = new if self.vectors is None else np.concatenate([self.vectors, new])
+        self.rows.extend([ids[i], documents[i], metadatas[i]] for i in keep)
+        # write both files aside, then swap them in, so a crash mid-write can't leave a
+        # truncated file (a crash between the two replaces is caught by the check in __init__)
+        with open(self.vec_path + ".tmp", "wb") as f:  # file handle: np.save won't append .npy
+            np.save(f, self.vectors)
+        with open(self.meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.rows, f)
+        os.replace(self.vec_path + ".tmp", self.vec_path)
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+        self.vectors = np.load(self.vec_path, mmap_mode="r")
+
+    def query(self, query_embeddings, n_results: int) -> Dict[str, Any]:
+        if not self.rows:
+            return {"documents": [[]], "metadatas": [[]], "distances": [[]]}
+        scores = self.vectors @ np.asarray(query_embeddings[0], dtype=np.float32)  # unit vectors: cosine
+        k = min(n_results, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return {
+            "documents": [[self.rows[i][1] for i in top]],
+            "metadatas": [[self.rows[i][2] for i in top]],
+            "distances": [[1.0 - float(scores[i]) for i in top]],
+        }
 
 class Retriever:
     def __init__(self, persist_dir: str = "chroma_db", embeddings_backend: str = "local"):
         self.persist_dir = persist_dir
-        self.client = chromadb.PersistentClient(path=self.persist_dir)
-        self.collection = self.client.get_or_create_collection(name="pranay_chunks", metadata={"hnsw:space": "cosine"})
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")  # small, fast, CPU OK
+        if VECTOR_INDEX == "flat":
+            self.client = None
+            self.collection = _FlatStore(self.persist_dir)
+        else:
+            if CHROMA_HOST:
+                self.client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+            else:
+                self.client = chromadb.PersistentClient(path=self.persist_dir)
+            self.collection = self.client.get_or_create_collection(name="pranay_chunks", metadata={"hnsw:space": "cosine"})
+        self.embeddings_backend = embeddings_backend
+        if embeddings_backend == "onnx":
+            # optional deps, only needed for this backend
+            from optimum.onnxruntime import ORTModelForFeatureExtraction
+            from transformers import AutoTokenizer
+            self.tokenizer = AutoTokenizer.from_pretrained(ONNX_MODEL_DIR)
+            self.onnx_model = ORTModelForFeatureExtraction.from_pretrained(ONNX_MODEL_DIR)
+        else:
+            # small, fast, CPU OK; on a CUDA box run it on the GPU in fp16
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+            self.model = SentenceTransformer("all-MiniLM-L6-v2", device=self.device)
+            if self.device == "cuda":
+                self.model.half()
+            self.model.encode(["warmup"])  # pay kernel/graph init here, not on the first search
+        # repeated questions skip the encoder entirely
+        self._query_embedding = lru_cache(maxsize=4096)(self._encode_query)
+        # semantic cache: ring buffer of unit query vectors + (k, stored at, results), FIFO eviction
+        self._sem_vecs: Optional[np.ndarray] = None
+        self._sem_ks = np.zeros(SEMANTIC_CACHE_SIZE, dtype=np.int64)
+        self._sem_times = np.zeros(SEMANTIC_CACHE_SIZE, dtype=np.float64)
+        self._sem_hits: List[Any] = [None] * SEMANTIC_CACHE_SIZE
+        self._sem_count = 0
+        self._sem_next = 0
+        self._sem_store_count = -1  # collection.count() the cached results were computed against
+        self._sem_checked_at = float("-inf")
 
     def is_ready(self) -> bool:
         return self.collection.count() > 0
 
     def _embed(self, texts: List[str]) -> List[List[float]]:
-        return self.model.encode(texts, normalize_embeddings=True).tolist()
+        if self.embeddings_backend == "onnx":
+            return self._embed_onnx(texts)
+        batch_size = 256 if self.device == "cuda" else 32
+        return self.model.encode(texts, batch_size=batch_size, normalize_embeddings=True,
+                                 convert_to_numpy=True).tolist()
+
+    def _embed_onnx(self, texts: List[str]) -> List[List[float]]:
+        # mean-pool + L2-normalize, matching SentenceTransformer's MiniLM pipeline.
+        # Batches are built from length-sorted texts so each one pads to a similar
+        # length, then rows are put back in input order.
+        order = np.argsort([len(t) for t in texts], kind="stable")
+        out = np.empty((len(texts), 0), dtype=np.float32)
+        for i in range(0, len(texts), ONNX_BATCH_SIZE):
+            idx = order[i:i + ONNX_BATCH_SIZE]
+            enc = self.tokenizer([texts[j] for j in idx], padding=True, truncation=True,
+                                 max_length=256, return_tensors="np")
+            hidden = self.onnx_model(**enc).last_hidden_state
+            mask = enc["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            if out.shape[1] == 0:
+                out = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            out[idx] = pooled
+        return out.tolist()
+
+    def _encode_query(self, query: str) -> tuple:
+        return tuple(self._embed([query])[0])  # tuple so cached vectors can't be mutated
 
     def ingest(self, paths: Iterable[str]):
+        batch_size = min(INGEST_BATCH, self.client.get_max_batch_size()) if self.client else INGEST_BATCH
         docs, metas, ids = [], [], []
-        for path in paths:
-            ext = path.lower()
-            if ext.endswith(".pdf"):
-                content = _read_pdf(path)
-            elif ext.endswith((".txt", ".md", ".markdown")):
-                content = _read_text_file(path)
-            else:
-                continue
+        paths = [p for p in paths if file_ext(p) in READERS]
+        for path, content in zip(paths, read_all(paths)):
             if not content.strip():
                 continue
 
@@ -64,20 +211,66 @@ class Retriever:
                 docs.append(ch)
                 metas.append({"source": os.path.basename(path)})
                 ids.append(f"{os.path.basename(path)}-{i}")
-                if len(docs) >= 256:
+                if len(docs) >= batch_size:
                     self._add_batch(ids, docs, metas)
                     docs, metas, ids = [], [], []
         if docs:
             self._add_batch(ids, docs, metas)
 
     def _add_batch(self, ids, docs, metas):
-        emb = self._embed(docs)
+        # boilerplate (headers, footers, licenses) repeats across files: embed each
+        # distinct chunk once and fan the vector back out to every copy
+        slot, uniq, back = {}, [], []
+        for d in docs:
+            h = hashlib.blake2b(d.encode("utf-8"), digest_size=16).digest()
+            if h not in slot:
+                slot[h] = len(uniq)
+                uniq.append(d)
+            back.append(slot[h])
+        uniq_emb = self._embed(uniq)
+        emb = [uniq_emb[i] for i in back]
         self.collection.add(ids=ids, embeddings=emb, documents=docs, metadatas=metas)
+        self._sem_count = self._sem_next = 0  # new chunks can change any cached answer
+
+    def _sem_get(self, q: np.ndarray, k: int) -> Optional[List[DocChunk]]:
+        # ingest may have run in another process: any change in size invalidates everything
+        now = time.monotonic()
+        if now - self._sem_checked_at >= SEMANTIC_CACHE_CHECK_SECS:
+            self._sem_checked_at = now
+            n = self.collection.count()
+            if n != self._sem_store_count:
+                self._sem_count = self._sem_next = 0
+                self._sem_store_count = n
+        if not self._sem_count:
+            return None
+        m = self._sem_count
+        sims = self._sem_vecs[:m] @ q  # unit vectors, so dot == cosine
+        # only live entries holding at least k results can answer this query
+        sims[(self._sem_times[:m] < now - SEMANTIC_CACHE_TTL) | (self._sem_ks[:m] < k)] = -np.inf
+        i = int(np.argmax(sims))
+        if sims[i] >= SEMANTIC_CACHE_SIM:
+            return _copy_chunks(self._sem_hits[i][:k])
+        return None
+
+    def _sem_put(self, q: np.ndarray, k: int, out: List[DocChunk]):
+        if self._sem_vecs is None:
+            self._sem_vecs = np.zeros((SEMANTIC_CACHE_SIZE, q.shape[0]), dtype=np.float32)
+        i = self._sem_next
+        self._sem_vecs[i] = q
+        self._sem_ks[i] = k
+        self._sem_times[i] = time.monotonic()
+        self._sem_hits[i] = _copy_chunks(out)
+        self._sem_next = (i + 1) % SEMANTIC_CACHE_SIZE
+        self._sem_count = min(self._sem_count + 1, SEMANTIC_CACHE_SIZE)
 
     def search(self, query: str, k: int = 5) -> List[DocChunk]:
         if not query.strip(): return []
-        q_emb = self._embed([query])
-        res = self.collection.query(query_embeddings=q_emb, n_results=k)
+        q_vec = self._query_embedding(query.strip())
+        q = np.asarray(q_vec, dtype=np.float32)
+        hit = self._sem_get(q, k)
+        if hit is not None:
+            return hit
+        res = self.collection.query(query_embeddings=[list(q_vec)], n_results=k)
         docs = res.get("documents", [[]])[0]
         metas = res.get("metadatas", [[]])[0]
         dists = res.get("distances", [[]])[0]
@@ -85,4 +278,5 @@ class Retriever:
         for text, meta, dist in zip(docs, metas, dists):
             out.append(DocChunk(text=text, metadata={"source": meta.get("source","unknown"),
                                                      "score": (1.0 - dist) if dist is not None else None}))
+        self._sem_put(q, k, out)
         return out
@@ -1,17 +1,24 @@
 # vision.py
-import base64, os
-from anthropic import Anthropic
+import os
+import pybase64
+from dotenv import load_dotenv
+from anthropic import Anthropic, DefaultHttpxClient
+
+# the key is read once at import below, so make sure .env is loaded first
+load_dotenv()
+
+# one client per process so requests reuse its connection pool / TLS sessions
+_client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY", ""), http_client=DefaultHttpxClient(http2=True))
 
 def _b64(b: bytes) -> str:
-    return base64.b64encode(b).decode("utf-8")
+    return pybase64.b64encode(b).decode("ascii")  # SIMD encoder, same output as stdlib
 
 def build_system_prompt(core: str, mode_text: str, context: str) -> str:
     return f"{core}\n\n{mode_text}\n\n{context}If you use the context, cite the source in brackets."
 
 def ask_with_image(system_prompt: str, user_text: str, image_bytes: bytes, media_type: str = "image/png", temperature: float = 0.4) -> str:
-    client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
     model = os.getenv("ANTHROPIC_MODEL", "claude-3-5-sonnet-latest")
-    resp = client.messages.create(
+    resp = _client.messages.create(
         model=model,
         max_tokens=1200,
         temperature=temperature,
@@ -25,8 +32,4 @@ def ask_with_image(system_prompt: str, user_text: str, image_bytes: bytes, media
         }],
     )
     # Join text blocks
-    parts = []
-    for blk in resp.content:
-        if blk.type == "text":
-            parts.append(blk.text)
-    return "\n".join(parts).strip()
+    return "\n".join(blk.text for blk in resp.content if blk.type == "text").strip()
@@ -424,14 +424,19 @@ async function handleSend() {
       headers: {"Content-Type":"application/json"},
       body: JSON.stringify({
         chat_id: useChatId,
-        message: text
+        message: text,
+        stream: true
       })
     });
-    responseData = await res.json();
+    if ((res.headers.get("Content-Type") || "").startsWith("text/event-stream")) {
+      responseData = await readChatStream(res, typingRef);
+    } else {
+      responseData = await res.json();
+    }
   }
 
   // update typing bubble -> real text
-  const finalReply = responseData.response || "Sorry, no response.";
+  const finalReply = responseData.response || responseData.assistant || "Sorry, no response.";
   replaceTypingBubble(typingRef, finalReply);
 
   // refresh chat list to pull new title
@@ -439,6 +444,39 @@ async function handleSend() {
   renderChatList();
 }
 
+// read SSE from /chat (stream: true), appending chunks to the typing bubble as
+// they arrive; resolves with the final {"done": true, ...} event
+async function readChatStream(res, typingRef) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let shown = "";
+  let finalEvent = {};
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let sep;
+    while ((sep = buffer.indexOf("\n\n")) !== -1) {
+      const line = buffer.slice(0, sep).trim();
+      buffer = buffer.slice(sep + 2);
+      if (!line.startsWith("data:")) continue;
+
+      const evt = JSON.parse(line.slice(5));
+      if (evt.done) {
+        finalEvent = evt;
+      } else if (evt.chunk) {
+        shown += evt.chunk;
+        typingRef.body.textContent = shown;
+        scrollMessagesToBottom();
+      }
+    }
+  }
+  return finalEvent;
+}
+
 // ==================================================
 // IMAGE ATTACH PREVIEW
 // ==================================================